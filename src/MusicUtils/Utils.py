@@ -1,9 +1,38 @@
 #! /usr/bin/env python3
 
-import magic
+import os
+import shutil
+
+# Suffixes of the audio files we handle.   Anything else can be rejected without reading it.
+AUDIO_SUFFIXES = frozenset(['.flac', '.mp3', '.m4a', '.mp4', '.aac', '.ogg', '.opus', '.wav', '.aif', '.aiff', '.ape', '.wma', '.wv', '.dsf'])
 
 def isAudio(path):
-    return magic.from_buffer(open(path, "rb").read(2048), mime=True).startswith('audio/')
+    """ Check for an audio file, by suffix if it's a known one, otherwise by sniffing the contents """
+    if os.path.splitext(path)[1].lower() in AUDIO_SUFFIXES:
+        return True
+    # Only import libmagic when something actually needs sniffing.  A raw read of the header is all it needs,
+    # there's no point setting up a buffered file object for it.
+    import magic
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        header = os.read(fd, 4096)
+    finally:
+        os.close(fd)
+    return magic.from_buffer(header, mime=True).startswith('audio/')
+
+def backupFile(path):
+    """
+    Backup a file before processing it.
+    """
+    bupPath = path.with_suffix(path.suffix + '.bak')
+    print(f"Backing up {path} to {bupPath}")
+    shutil.copy2(path, bupPath)
+
+def noSlash(tag):
+    """ Strip a 'n/total' style track or disk number down to n """
+    if tag.find('/') != -1:
+        tag = tag[0:tag.find('/')]
+    return tag
 
 def addTuples(*args):
     return tuple(map(sum, zip(*args)))
@@ -173,7 +173,7 @@ def convert(job):
     if args.copytime:
         try:
             logger.debug("Setting times for %s to %s, %s", dest, time.ctime(times.st_atime), time.ctime(times.st_mtime))
-            os.utime(dest, times=(times.st_atime, times.st_mtime))
+            os.utime(dest, ns=(times.st_atime_ns, times.st_mtime_ns))
         except Exception as e:
             return src, dest, f"{src} -> {dest} failed copying time {e}"
 
@@ -1,8 +1,8 @@
 #! /usr/bin/env python3
 
 import argparse
+import os
 import pathlib
-import magic
 import pprint
 import sys
 
@@ -10,8 +10,7 @@ from functools import cache
 
 import music_tag
 
-def isAudio(path):
-    return magic.from_file(str(path), mime=True).startswith('audio/')
+from MusicUtils.Utils import isAudio
 
 def parse_args():
     p = argparse.ArgumentParser("Check music files for consistent tagging")
@@ -22,11 +21,12 @@ def parse_args():
     args = p.parse_args()
     return(args)
 
-def loadTags(d):
+def loadTags(d, names=None):
     #print(f"Loading tags for dir {d}")
     data = {}
 
-    files = d.iterdir()
+    # Use the names if the directory has already been listed
+    files = d.iterdir() if names is None else (d / n for n in names)
     for f in files:
         if f.is_file() and isAudio(f):
             data[f.name] = music_tag.load_file(f.resolve())
@@ -76,20 +76,21 @@ def printDetails(details):
         names[v] = fmtTuple(v) + ": "
     maxLen = max(map(len, (names.values())))
 
+    indent = " " * (maxLen + 4)
     for v in details.keys():
         lines = pprint.pformat(details[v], compact=True, width=120).splitlines()
         report(f"    {names[v]:{maxLen}} {lines[0]}")
         for l in lines[1:]:
-            print(" " * (maxLen + 4), l)
+            print(indent, l)
 
 album_tags = ['album', 'artist', 'albumartist', 'genre', 'artistsort', 'albumartistsort', 'totaldisks', 'artwork', 'media' ]
 disk_tags =  ['disknumber', 'totaltracks']
 
-def checkConsistency(directory, details):
+def checkConsistency(directory, details, names=None):
     if not directory.is_dir():
         return
 
-    data =  loadTags(directory)
+    data =  loadTags(directory, names)
 
     if data:
         for tag in album_tags:
@@ -144,6 +145,7 @@ def checkConsistency(directory, details):
 
 _first = True
 _dir = None
+_separator = "-" * 40
 def setDir(d):
     global _first, _dir
     _dir = d
@@ -152,8 +154,7 @@ def setDir(d):
 def report(string):
     global _first
     if _first:
-        print("-" * 40)
-        print(_dir)
+        print(f"{_separator}\n{_dir}")
         _first = False
     print(string)
 
@@ -175,12 +176,17 @@ def fmtTuples(x):
 
 
 def checkDir(d, details, recurse):
-    setDir(d)
-    checkConsistency(d, details)
-    if recurse:
-        for i in sorted(d.iterdir()):
-            if i.is_dir():
-                checkDir(i, details, True)
+    if not recurse:
+        setDir(d)
+        checkConsistency(d, details)
+        return
+
+    # Walk the tree in a single pass, and reuse the walk's file names, so each directory is only listed once
+    for dirpath, dirnames, filenames in os.walk(d):
+        dirnames.sort()
+        path = pathlib.Path(dirpath)
+        setDir(path)
+        checkConsistency(path, details, filenames)
 
 def main():
     try:
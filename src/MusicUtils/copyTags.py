@@ -29,7 +29,6 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import argparse
-import shutil
 import sys
 import os
 import pprint
@@ -39,7 +38,7 @@ import music_tag
 
 from termcolor import colored
 
-from MusicUtils.Utils import isAudio
+from MusicUtils.Utils import isAudio, backupFile, addTuples
 
 class PrintOnce:
     def __init__(self, message):
@@ -51,14 +50,6 @@ class PrintOnce:
             print(self.message)
             self.first = False
 
-def backupFile(path):
-    bupPath = Path(path.with_suffix(path.suffix + '.bak'))
-    print(f"Backing up {path} to {bupPath}")
-    shutil.copy2(path, bupPath)
-
-def addTuples(*args):
-    return tuple(map(sum, zip(*args)))
-
 def makeBaseNameDict(names):
     d = { x.stem:x for x in names }
     return d
@@ -167,8 +158,9 @@ def copyTags(frTags, toTags, tags, replace, delete, details=None):
                 if toValue:
                     #print(tag, frValue, toValue, type(frValue), type(toValue))
                     if tag == 'artwork':
-                        # TODO: This should check all artwork, but I'm lazy, assuming only one in my library.
-                        if frValue.first.data == toValue.first.data:
+                        # Compare every image, not just the first.  Differing counts or sizes fail without
+                        # touching the image data, only same-sized images are compared byte for byte.
+                        if [a.data for a in frValue.values] == [a.data for a in toValue.values]:
                             continue
                     elif frValue.values == toValue.values:
                         continue
@@ -209,7 +201,7 @@ def copyFile(fromPath, toPath, backup=False, replace=False, delete=False, dryrun
         if backup and not dryrun:
             backupFile(toPath)
 
-        times = toPath.stat()
+        times = toPath.stat() if preserve else None
 
         frTags = music_tag.load_file(fromPath)
         toTags = music_tag.load_file(toPath)
@@ -223,13 +215,13 @@ def copyFile(fromPath, toPath, backup=False, replace=False, delete=False, dryrun
 
         if short:
             if added:
-                tags = list(map(lambda x: x[0], added))
+                tags = [x[0] for x in added]
                 print(f"{colored('Added', 'cyan'):17}: {pprint.pformat(tags, compact=True, width=132)}")
             if replaced:
-                tags = list(map(lambda x: x[0], replaced))
+                tags = [x[0] for x in replaced]
                 print(f"{colored('Replaced', 'cyan'):17}: {pprint.pformat(tags, compact=True, width=132)}")
             if deleted:
-                tags = list(map(lambda x: x[0], deleted))
+                tags = [x[0] for x in deleted]
                 print(f"{colored('Deleted', 'cyan'):17}: {pprint.pformat(tags, compact=True, width=132)}")
             if not (added or deleted or replaced):
                 print(colored("Nothing changed", "cyan"))
@@ -248,7 +240,7 @@ def copyFile(fromPath, toPath, backup=False, replace=False, delete=False, dryrun
         if changed and not dryrun:
             toTags.save()
             if preserve:
-                os.utime(toPath, times=(times.st_atime, times.st_mtime))
+                os.utime(toPath, ns=(times.st_atime_ns, times.st_mtime_ns))
     except Exception as e:
         print(colored("Error", "red") + f" Error processing file {colored(fromPath, 'yellow')}")
         print(str(e))
@@ -13,6 +13,8 @@ import sys
 
 from pymediainfo import MediaInfo
 
+from MusicUtils.Utils import noSlash, AUDIO_SUFFIXES
+
 class NotAudioException(Exception):
     pass
 
@@ -51,11 +53,6 @@ _maxlens = {}
 def setMaxLen(name, value):
     _maxlens[name] = min(max(_maxlens.get(name, 0), len(value)), 80)
 
-def noSlash(tag):
-    if tag.find('/') != -1:
-        tag = tag[0:tag.find('/')]
-    return tag
-
 def clean(string):
     return unicodedata.normalize('NFKC', string).strip()
 
@@ -112,7 +109,7 @@ def getTags(f):
         tags = info.general_tracks[0].to_data()
         if log.isEnabledFor(logging.DEBUG):
             log.debug(f"Info for {f}")
-            interesting = dict(filter(lambda x: x[0] in interestingTags, tags.items()))
+            interesting = {k: v for k, v in tags.items() if k in interestingTags}
             log.debug(interesting)
 
         setMaxLen('format', tags.get('format', ''))
@@ -271,8 +268,10 @@ def processDirTree(d, base):
         for f in files:
             if f.is_dir():
                 dirs.append(f)
-            else:
+            elif f.suffix.lower() in AUDIO_SUFFIXES:
                 processFile(f, base)
+            else:
+                log.debug(f"Skipping non-audio file {f}")
 
         for x in dirs:
             processDirTree(x, base)
@@ -30,14 +30,17 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import argparse
+import fnmatch
 import os
 import os.path
+import sys
 import logging
 import pathlib
 import unicodedata
 import shutil
-from collections import Counter, defaultdict
-from functools import reduce
+from collections import Counter, defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce, lru_cache
 from enum import Enum
 
 import regex as re
@@ -45,26 +48,48 @@ import regex as re
 import colorlog
 import unidecode
 import music_tag
-import magic
+
+from MusicUtils.Utils import isAudio, noSlash
 
 class NotAudioException(Exception):
     """ Class to indicate a file is not an audio file """
 
+# An audio file, with the path components the naming functions need split out once
+AudioEntry = namedtuple("AudioEntry", ["path", "name", "suffix", "parent", "tags"])
+
+def audioEntry(path, tags):
+    return AudioEntry(path, path.name, path.suffix, path.parent, tags)
+
 class Action(Enum):
     ACTION_LINK=1
     ACTION_MOVE=2
     ACTION_COPY=3
     ACTION_SYMLINK=4
 
+# The function implementing each action, called as func(src, dest)
+actionFuncs = {
+    Action.ACTION_LINK:     os.link,
+    Action.ACTION_SYMLINK:  os.symlink,
+    Action.ACTION_MOVE:     os.rename,
+    Action.ACTION_COPY:     shutil.copy2,
+}
+
 bases_default = os.environ.get('REORG_TYPES', '').split()
 base_default = os.environ.get('REORG_BASE', '.')
 
 args = None
 log = None
 bases = None
+executor = None
+dragNames = None
+dragPaths = None
+actionLabel = None
+munge = None
+createdDirs = set()
 
 def processArgs():
     _def = ' (default: %(default)s)'
+    processors = os.cpu_count()
 
     parser = argparse.ArgumentParser(description="Reorganize music files", add_help=True)
 
@@ -123,6 +148,8 @@ def processArgs():
     parser.add_argument('--unknown', dest='unknown', default=True, action=argparse.BooleanOptionalAction,
                         help="Ignore 'unknown' files without artist or album info")
 
+    parser.add_argument('--workers', '-w', dest='workers', type=int, default=processors * 2,
+                        help="Number of threads to use reading tags" + _def)
     parser.add_argument('--warn-non-audio', dest='warnNonAudio', default=False, action=argparse.BooleanOptionalAction,
                         help="Ignore non-audio files")
     parser.add_argument('--verbose', '-v', dest='verbose', action='count', default=0,
@@ -133,61 +160,78 @@ def processArgs():
 
     return parser.parse_args()
 
-def munge(name):
-    """ Mangle a name such that it's completely printable """
-    if name is None:
-        name = ""
-    if args.normalize:
+# Remove all punctuation, except -,_, and all control characters (what the f**k are these doing in a name anyhow?)
+_deleteChars = re.compile(r'[^\P{Punct}\-,_]|\p{Cntrl}')
+# The same deletions as a translation table, for pure ASCII names
+_asciiDeletes = str.maketrans('', '', ''.join(c for c in map(chr, range(128)) if _deleteChars.match(c)))
+# Convert runs of spaces and underscores to a single underscore
+_underscores = re.compile(r'[\s_]+')
+# Leading articles, matched after spaces have been converted
+_articles = re.compile(r'^(The|A|An)_')
+
+def normalize(name):
+    """ Normalize a name, if requested.  ASCII strings are already normalized """
+    if args.normalize and not name.isascii():
         name = unicodedata.normalize('NFKC', name)
-    if args.ascii:
-        name = unidecode.unidecode(name)
-    #name = re.sub(r'[/&\.\[\]\$\"\'\?\(\)\<\>\!\:\;\~\p{P}]', '', name)
-    #name = re.sub(r'[^\w\s,]', '', name)
-    #name = re.sub(r'[/&\.\[\]\$\"\'\?\(\)\<\>\!\:\;\~]', '', name)
-
-    # Remove all punctuation, except -,_
-    name = re.sub(r'[^\P{Punct}-,_]', '', name)
-    # Remove all control characters (what the f**k are these doing in a name anyhow?)
-    name = re.sub(r'[\p{Cntrl}]', '', name)
-    # Convert all spaces to underscores
-    name = re.sub(r'\s', '_', name)
-    # Convert multiple underscores to a single underscore
-    name = re.sub(r'_+', '_', name)
-    # Re
-    if not args.useArticle:
-        name = re.sub(r"^(The|A|An)\s+", "", name)
-    name = name.strip('_')
     return name
 
+def makeMunge(opts):
+    """ Build the munge function, with the options resolved once rather than on every call """
+    doNormalize = opts.normalize
+    toAscii = opts.ascii
+    stripArticles = not opts.useArticle
+
+    # Artist, album and composer names repeat for every file in an album
+    @lru_cache(maxsize=1024)
+    def munge(name):
+        """ Mangle a name such that it's completely printable """
+        if name is None:
+            name = ""
+        if name.isascii():
+            # ASCII strings are already normalized, and need no transliteration
+            name = name.translate(_asciiDeletes)
+        else:
+            if doNormalize:
+                name = unicodedata.normalize('NFKC', name)
+            if toAscii:
+                name = unidecode.unidecode_expect_nonascii(name)
+            name = _deleteChars.sub('', name)
+        name = _underscores.sub('_', name)
+        if stripArticles:
+            name = _articles.sub('', name)
+        name = name.strip('_')
+        return name
+
+    return munge
+
 
 def longestName(files):
     if files:
         return reduce(max, map(lambda x: len(str(x)), files))
     return 0
 
-def noSlash(tag):
-    if tag.find('/') != -1:
-        tag = tag[0:tag.find('/')]
-    return tag
-
-def makeFName(file, tags):
+def makeFName(entry):
     name = ""
-    diskno = tags.get('discnumber').first
-    totaldiscs = tags.get('totaldiscs').first
+    get = entry.tags.get
+    diskno = get('discnumber').first
+    totaldiscs = get('totaldiscs').first
 
-    title = tags.get('tracktitle').first
+    title = get('tracktitle').first
     if title is None:
         if not args.unknown:
             return None
         title = 'Unknown'
 
-    if 'subtitle' in tags:
-        title = title + " " + tags.get('subtitle').first
+    # Fetch each item once, rather than testing membership and then getting it
+    subtitle = get('subtitle')
+    if subtitle.values:
+        title = title + " " + subtitle.first
     #elif 'part' in tags:
     #    title = title + " " + str(tags.get('part'))
 
-    if 'tracknumber' in tags:
-        track = str(tags.get('tracknumber'))
+    tracknumber = get('tracknumber')
+    if tracknumber.values:
+        track = str(tracknumber)
     else:
         track = '0'
 
@@ -203,20 +247,18 @@ def makeFName(file, tags):
     maxlen = max(args.maxlength - len(trk), 5)
 
     #name = "{0}.{1}{2}".format(trk, munge(title)[0:m].strip(), f.suffix)
-    name = f"{trk}.{munge(title)[0:maxlen]}{file.suffix}"
-    log.debug(f"Name {file.name} -> {name}")
+    name = f"{trk}.{munge(title)[0:maxlen]}{entry.suffix}"
+    log.debug(f"Name {entry.name} -> {name}")
     return name
 
 def makeComposerString(composers, maxcomps=3):
-    # Make a unique list of composers.
-    unique = list(map(munge, sorted(composers)))
+    # Make a unique list of composers, only munging the ones which will be listed.
+    ordered = sorted(set(composers))
 
-    listed = unique[:maxcomps]
+    listed = list(map(munge, ordered[:maxcomps]))
     if len(listed) > 1:
-        string = ",_".join(listed[:-1])
-        if len(listed) > 1:
-            string = "_&_".join([string, listed[-1]])
-        if len(unique) > maxcomps:
+        string = "_&_".join([",_".join(listed[:-1]), listed[-1]])
+        if len(ordered) > maxcomps:
             string += '_et_al'
     else:
         string = listed[0]
@@ -228,39 +270,51 @@ def getArtist(tags):
     log.debug(f"Retrieved artist: {artist}")
     return artist
 
-def makeDName(file, tags, dirname=None):
+def makeDName(entry, dirname=None, cache=None):
+    """ Generate the destination directory.  cache, if supplied, maps (codec, dirname, album) to previous results """
     if args.inplace:
-        base = file.parent
+        base = entry.parent
     else:
-        codec = tags.get('#codec').first.split('.')[0].lower()
-        base = pathlib.Path(bases.get(codec, args.base))
-        log.debug(f"BaseDir: {base}")
+        tags = entry.tags
+        get = tags.get
+        codec = get('#codec').first.split('.')[0].lower()
 
         if dirname is None:
-            compilation = str(tags.get('compilation')).lower()
+            compilation = str(get('compilation')).lower()
+            albumartist = get('albumartist') if args.albartist else None
             if compilation in ['yes', '1', 'true']:
                 dirname = args.various
-            elif args.albartist and tags.get('albumartist'):
-                dirname = tags.get('albumartist').first
+            elif albumartist:
+                dirname = albumartist.first
             else:
                 dirname = getArtist(tags)
             dirname = munge(dirname)
 
-        album = tags.get('album').first
-        if not album:
-            if not args.unknown:
-                return None
-            album = 'Unknown'
+        album = get('album').first
+        key = (codec, dirname, album)
+        if cache is not None and key in cache:
+            base = cache[key]
+        else:
+            base = pathlib.Path(bases.get(codec, args.base))
+            log.debug(f"BaseDir: {base}")
+
+            if not album:
+                if not args.unknown:
+                    base = None
+                else:
+                    album = 'Unknown'
+            if base is not None:
+                base = base.joinpath(dirname, munge(album))
+            if cache is not None:
+                cache[key] = base
 
-        base = base.joinpath(dirname, munge(album))
+        if base is None:
+            return None
 
-    log.debug(f"Dir: {file.parent} -> {base}")
+    log.debug(f"Dir: {entry.parent} -> {base}")
     return base
 
 
-def isAudio(file):
-    return magic.from_buffer(open(file, 'rb').read(2048), mime=True).startswith("audio")
-
 def getTags(file):
     log.debug(f"Getting tags from file {file}")
     if not isAudio(file):
@@ -272,46 +326,49 @@ def getTags(file):
         log.warning(f"Could not retrieve tags from {file}: {exc}")
         raise NotAudioException(file.resolve()) from exc
 
-def makeName(file, tags, dirname = None):
-    dirname = makeDName(file, tags, dirname)
+def makeName(entry, dirname = None, cache=None):
+    dirname = makeDName(entry, dirname, cache)
+    if dirname is None:
+        return None
 
-    newFile = dirname.joinpath(makeFName(file, tags))
+    newFile = dirname.joinpath(makeFName(entry))
 
-    log.debug(f"FullName {file} -> {newFile}")
+    log.debug(f"FullName {entry.path} -> {newFile}")
     return newFile
 
 def dragFiles(dragfiles, destdir, length):
-    action = actionName()
     if not length:
-        length = longestName(dragFiles)
+        length = longestName(dragfiles)
     for file in dragfiles:
         dest = destdir.joinpath(file.name)
         if file.exists() and not dest.exists():
-            log.log(logging.ACTION, f"{action} {str(file):{length}}\t==>  {dest}")
+            log.log(logging.ACTION, f"{actionLabel} {str(file):{length}}\t==>  {dest}")
             doMove(file, dest)
 
+def makeDir(directory):
+    if directory not in createdDirs:
+        log.debug(f"Creating {directory}")
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+        except FileExistsError as exc:
+            raise NotADirectoryError(f"{directory} exists, and is not a directory") from exc
+        createdDirs.add(directory)
+
 def doMove(src, dest):
     if not args.test:
-        if not dest.parent.exists():
-            log.debug(f"Creating {dest.parent}")
-            dest.parent.mkdir(parents=True, exist_ok=True)
-        elif not dest.parent.is_dir():
-            #log.warning(f"{dest.parent} exists, and is not a directory")
-            raise NotADirectoryError("{dest.parent} exists, and is not a directory")
-
-        match args.action:
-            case Action.ACTION_LINK:
-                dest.unlink(missing_ok=True)
-                dest.hardlink_to(src)
-            case Action.ACTION_SYMLINK:
-                dest.unlink(missing_ok=True)
-                dest.symlink_to(src)
-            case Action.ACTION_MOVE:
-                src.rename(dest)
-            case Action.ACTION_COPY:
-                shutil.copy2(src, dest)
-            case _:
-                raise ValueError(f"Unknown action: {args.action}")
+        makeDir(dest.parent)
+
+        func = actionFuncs.get(args.action)
+        if func is None:
+            raise ValueError(f"Unknown action: {args.action}")
+
+        src, dest = os.fspath(src), os.fspath(dest)
+        if args.action in (Action.ACTION_LINK, Action.ACTION_SYMLINK):
+            try:
+                os.unlink(dest)
+            except FileNotFoundError:
+                pass
+        func(src, dest)
 
 
 def actionName():
@@ -325,40 +382,50 @@ def actionName():
         case Action.ACTION_SYMLINK:
             name = "SymLinking"
         case _:
-            name = "Unknowwn"
+            name = "Unknown"
     if args.test:
         name = "[-] " + name
     return name
 
 
-def renameFile(file, tags, dragfiles=None, dirname=None, length=0):
-    action = actionName()
+def renameFile(entry, dragfiles=None, dirname=None, length=0, cache=None, dest=None, known=False):
+    """ Move a file to its destination.  If known is set, dest is makeName's result (or exception), already worked out """
+    file = entry.path
     if not length:
         length = len(str(file))
     try:
-        dest = makeName(file, tags, dirname)
+        if isinstance(dest, Exception):
+            # Report it along with any other failures
+            raise dest
+        if not known:
+            dest = makeName(entry, dirname, cache)
         if dest is None:
-            log.info(f"Skipping file {file.name}.   Unknown album or artist")
+            log.info(f"Skipping file {entry.name}.   Unknown album or artist")
             return None
 
         if file.expanduser().absolute() == dest.expanduser().absolute():
             log.debug(f"Src {file} and dest {dest} are the same.   No changes")
             return dest
 
-        if dest.exists():
-            if not file.samefile(dest):
+        # One stat of the destination answers both whether it exists and whether it's the same file
+        try:
+            destStat = dest.stat()
+        except FileNotFoundError:
+            destStat = None
+        if destStat is not None:
+            if not os.path.samestat(file.stat(), destStat):
                 if not args.force:
                     log.warning(f"{dest} exists, skipping ({file})")
                     return dest
                 else:
                     log.warning(f"Overwriting existing file {dest} with {file}")
 
-        if args.ignorecase and file.name.lower() == dest.name.lower():
-            log.debug(f"Not moving {file.name} to {dest.name}.   Change is only in case")
+        if args.ignorecase and entry.name.lower() == dest.name.lower():
+            log.debug(f"Not moving {entry.name} to {dest.name}.   Change is only in case")
             return dest
 
 
-        log.log(logging.ACTION, f"{action} {str(file):{length}s} \t==>  {dest}")
+        log.log(logging.ACTION, f"{actionLabel} {str(file):{length}s} \t==>  {dest}")
 
         doMove(file, dest)
 
@@ -373,17 +440,30 @@ def renameFile(file, tags, dragfiles=None, dirname=None, length=0):
     except FileExistsError as exc:
         log.warning(f"Destination file {dest} exists.  Cannot move")
         return dest
+    except OSError as exc:
+        # Expected filesystem failures (permissions, missing files), no need for a traceback
+        log.warning(f"Could not process {entry.name}: {exc}")
+        return None
     except Exception as exc:
-        log.warning(f"Caught exception {exc} processing {file.name}")
+        log.warning(f"Caught exception {exc} processing {entry.name}")
         log.exception(exc)
         return None
 
 def isDraggable(file):
-    for pat in args.drag:
+    if dragNames and dragNames.match(file.name):
+        return True
+    for pat in dragPaths:
         if file.match(pat):
             return True
     return False
 
+def compileDragPatterns(patterns):
+    """ Combine the name only drag patterns into a single regex, patterns with directories still need Path.match """
+    names = [pat for pat in patterns if '/' not in pat]
+    paths = [pat for pat in patterns if '/' in pat]
+    regex = re.compile('|'.join(map(fnmatch.translate, names))) if names else None
+    return regex, paths
+
 def classicalArtist(tags):
     if tags.get('composersort') and args.surname:
         return tags.get('composersort').first
@@ -394,72 +474,122 @@ def classicalArtist(tags):
     return None
 
 def reorgDir(directory, recurse):
-    try:
-        log.info(f"Processing Directory {directory}")
-        dirs = []
-        audio = []
-        composers = set()
-        dragfiles = []
-        destdirs = Counter()
-        files = sorted(filter(lambda x: not x.name.startswith('.'), list(directory.iterdir())))
-        maxLen = longestName(files)
-
-        composerStr = None
-
-        for file in files:
-            try:
-                log.debug(f"Checking {file} -- {file.is_dir()} {file.is_file()}")
-                if file.is_dir():
-                    dirs.append(file)
-                elif file.is_file():
-                    if isDraggable(file):
-                        dragfiles.append(file)
-                    else:
-                        tags = getTags(file)
-                        audio.append((file, tags))
-                        if args.classical:
-                            composers.add(classicalArtist(tags))
-
-            except NotAudioException as exc:
-                if args.warnNonAudio:
-                    log.warning(exc)
-            except Exception as exc:
-                log.warning(f"Caught exception processing {file}: {exc}")
-                log.exception(exc)
+    """ Reorganize a directory tree.   Directories are cleaned up after all their subdirectories """
+    # Entries are (directory, None) to process the directory, or (directory, dragfiles) to clean it up
+    stack = deque([(directory, None)])
+    while stack:
+        directory, dragfiles = stack.pop()
+        try:
+            if dragfiles is not None:
+                cleanupDir(directory, dragfiles)
+                continue
+
+            dirs, dragfiles = reorgFiles(directory)
+            if args.cleanup:
+                stack.append((directory, dragfiles))
+            if recurse:
+                # Reversed, so the subdirectories are popped in sorted order
+                stack.extend((subdir, None) for subdir in reversed(dirs))
+        except Exception as exc:
+            log.warning(f"Caught exception processing {directory}: {exc}")
+            log.exception(exc)
+            raise exc
+
+def reorgFiles(directory):
+    """ Reorganize the files in a single directory, returning its subdirectories and dragged files """
+    log.info(f"Processing Directory {directory}")
+    dirs = []
+    audio = []
+    composers = set()
+    dragfiles = []
+    destdirs = Counter()
+    # DirEntry caches the file type from the directory read, saving a stat per file
+    with os.scandir(directory) as it:
+        entries = sorted((e for e in it if not e.name.startswith('.')), key=lambda e: e.name)
+    files = [directory / e.name for e in entries]
+    maxLen = longestName(files)
+
+    composerStr = None
+    candidates = []
+
+    for entry, file in zip(entries, files):
+        try:
+            log.debug(f"Checking {file} -- {entry.is_dir()} {entry.is_file()}")
+            if entry.is_dir():
+                dirs.append(file)
+            elif entry.is_file():
+                if isDraggable(file):
+                    dragfiles.append(file)
+                else:
+                    # Read the tags in the background, the renames below are done in order
+                    candidates.append((file, executor.submit(getTags, file)))
+        except OSError as exc:
+            log.warning(f"Could not check {file}: {exc}")
+        except Exception as exc:
+            log.warning(f"Caught exception processing {file}: {exc}")
+            log.exception(exc)
+
+    for file, future in candidates:
+        try:
+            tags = future.result()
+            audio.append(audioEntry(file, tags))
+            if args.classical:
+                # Normalize here so different encodings of the same composer collapse
+                composer = classicalArtist(tags)
+                if composer is not None:
+                    composers.add(normalize(composer))
+        except NotAudioException as exc:
+            if args.warnNonAudio:
+                log.warning(exc)
+        except OSError as exc:
+            log.warning(f"Could not read tags from {file}: {exc}")
+        except Exception as exc:
+            log.warning(f"Caught exception processing {file}: {exc}")
+            log.exception(exc)
 
-        if args.classical and composers:
-            composerStr = makeComposerString(composers)
-
-        for finfo in audio:
-            dest = renameFile(finfo[0], finfo[1], dragfiles=dragfiles, dirname=composerStr, length=maxLen)
-            if dest:
-                if not dest.parent in destdirs:
-                    dragFiles(dragfiles, dest.parent, maxLen)
-                destdirs[dest.parent] += 1
-
-        if len(destdirs) > 1:
-            log.warning(f"Not all files from {directory} went to the same directory: ")
-            for targ in destdirs:
-                log.warning(f"    {targ}: {destdirs[targ]} file(s)")
-
-        if recurse:
-            for subdir in dirs:
-                reorgDir(subdir, recurse)
-
-        if args.cleanup:
-            if dragfiles:
-                log.info("Removing dragged files: %s", " ".join(dragfiles))
-                if not args.test:
-                    map(pathlib.Path.unlink, dragfiles)
-            if not any(directory.iterdir()):
-                log.info("Removing empty directory %s", directory)
-                if not args.test:
-                    directory.rmdir()
+    if args.classical and composers:
+        composerStr = makeComposerString(composers)
 
-    except Exception as exc:
-        log.warning(f"Caught exception processing {directory}: {exc}")
-        log.exception(exc)
-        raise exc
+    # Work out the destinations first, so each album directory is created once, up front.
+    # Any failure is kept in place of the destination, for renameFile to report.
+    dnames = {}
+    dests = []
+    for entry in audio:
+        try:
+            dests.append(makeName(entry, composerStr, dnames))
+        except Exception as exc:
+            dests.append(exc)
+
+    if not args.test:
+        for destdir in {dest.parent for dest in dests if isinstance(dest, pathlib.Path)}:
+            try:
+                makeDir(destdir)
+            except OSError as exc:
+                log.debug(f"Could not create {destdir}: {exc}")
+
+    for entry, dest in zip(audio, dests):
+        dest = renameFile(entry, dragfiles=dragfiles, dirname=composerStr, length=maxLen, cache=dnames, dest=dest, known=True)
+        if dest:
+            if not dest.parent in destdirs:
+                dragFiles(dragfiles, dest.parent, maxLen)
+            destdirs[dest.parent] += 1
+
+    if len(destdirs) > 1:
+        log.warning(f"Not all files from {directory} went to the same directory: ")
+        for targ in destdirs:
+            log.warning(f"    {targ}: {destdirs[targ]} file(s)")
+
+    return dirs, dragfiles
+
+def cleanupDir(directory, dragfiles):
+    if dragfiles:
+        log.info("Removing dragged files: %s", " ".join(dragfiles))
+        if not args.test:
+            map(pathlib.Path.unlink, dragfiles)
+    if not any(directory.iterdir()):
+        log.info("Removing empty directory %s", directory)
+        if not args.test:
+            directory.rmdir()
 
 def initLogging():
     # Create a custom logging attachment
@@ -491,11 +621,17 @@ def initLogging():
 
 
 def main():
-    global args, log, bases
+    global args, log, bases, executor, dragNames, dragPaths, actionLabel, munge
 
     args = processArgs()
     log = initLogging()
 
+    munge = makeMunge(args)
+
+    actionLabel = actionName()
+
+    dragNames, dragPaths = compileDragPatterns(args.drag)
+
     bases = defaultdict(lambda: args.base)
 
     if args.split:
@@ -508,20 +644,21 @@ def main():
 
     maxLength = longestName(args.files)
 
-    for file in args.files:
-        try:
-            if not file.exists():
-                log.error(f"{file} doesn't exist")
-            elif file.is_dir():
-                reorgDir(file, args.recurse)
-            elif file.is_file():
-                tags = getTags(file)
-                renameFile(file, tags, length=maxLength)
-        except KeyboardInterrupt:
-            log.info("Aborting")
-        except Exception as exc:
-            log.warning(f"Caught exception processing {file}: {exc}")
-            log.exception(exc)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for file in args.files:
+            try:
+                if not file.exists():
+                    log.error(f"{file} doesn't exist")
+                elif file.is_dir():
+                    reorgDir(file, args.recurse)
+                elif file.is_file():
+                    tags = getTags(file)
+                    renameFile(audioEntry(file, tags), length=maxLength)
+            except KeyboardInterrupt:
+                log.info("Aborting")
+            except Exception as exc:
+                log.warning(f"Caught exception processing {file}: {exc}")
+                log.exception(exc)
 
 def run():
     try:
@@ -35,8 +35,11 @@ import tempfile
 import os
 import sys
 import json
+import shlex
+import subprocess
 
 from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import yaml
 import music_tag
@@ -44,7 +47,20 @@ from termcolor import cprint, colored
 
 from .Utils import isAudio, addTuples
 
-ALL_TAGS = list(map(str.lower, filter(lambda x: not x.startswith('#') and not x.upper() == 'ARTWORK', music_tag.tags())))
+# Use the libyaml based implementations when available
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+# Likewise orjson, if installed, for the json format.  The fallback writes exactly the same output
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ALL_TAGS = tuple(t.lower() for t in music_tag.tags() if not t.startswith('#') and t.upper() != 'ARTWORK')
+ALL_TAGS_SET = frozenset(ALL_TAGS)
 
 def parseArgs():
     parser = argparse.ArgumentParser(description="Edit the tags in a collect of files")
@@ -61,6 +77,7 @@ def parseArgs():
     parser.add_argument("--promote", "-P", action=argparse.BooleanOptionalAction, default=True, help="Promote common elements to the album or disc level")
     parser.add_argument("--confirm", "-C", action=argparse.BooleanOptionalAction, default=True, help="Confirm writing of files")
     parser.add_argument("--dryrun", "-n", action=argparse.BooleanOptionalAction, default=False, help="Inoke an editor to edit the generated data")
+    parser.add_argument("--workers", "-w", type=int, default=8, help="Number of files to load or save in parallel")
     parser.add_argument("--editor", "-E", type=str, default=os.environ.get('EDITOR', 'nano'), help="Editor to use")
     parser.add_argument(type=pathlib.Path, nargs='+', dest='files', help='Files to change')
 
@@ -68,6 +85,7 @@ def parseArgs():
 
 
 def checkFile(file):
+    # isAudio checks the suffix first, and only sniffs the contents of files it doesn't recognise
     try:
         if not (file.is_file() and isAudio(file)):
             #print(f"{colored('Error: ', 'red')} {file} isn't an audio file")
@@ -80,33 +98,44 @@ def checkFile(file):
 
 stats = Counter()
 
-def doLoadFiles(files: list[pathlib.Path]):
-    toLoad = [f for f in files if checkFile(f)]
-    return list(map(music_tag.load_file, toLoad))
+def doLoadFiles(files: list[pathlib.Path], workers=None):
+    # Loading is I/O bound, so overlap it across threads.  map preserves the order.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(music_tag.load_file, files))
 
-def loadFiles(files: list[pathlib.Path]):
+def scanDir(directory):
+    # scandir already knows the file types, so the entries can be filtered without a stat per file, and
+    # isAudio only has to look inside files without a known audio suffix
+    with os.scandir(directory) as entries:
+        return [pathlib.Path(e.path) for e in entries if e.is_file() and isAudio(e.path)]
+
+def findFiles(files: list[pathlib.Path], workers=None):
+    """ The audio files to work on, either those in a directory, or those named that are audio files """
     if len(files) == 1 and files[0].is_dir():
-        return doLoadFiles(files[0].iterdir())
-    return doLoadFiles(files)
+        return scanDir(files[0])
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [f for f, ok in zip(files, executor.map(checkFile, files)) if ok]
+
+def loadFiles(files: list[pathlib.Path], workers=None):
+    return doLoadFiles(findFiles(files, workers), workers)
 
 def noList(value):
-    if type(value) is list and len(value) == 1:
+    if isinstance(value, list) and len(value) == 1:
         return value[0]
     return value
 
 def makeDict(tags):
-    d = dict(map(lambda x: (x, noList(tags[x].values)),
-                 [f for f in tags.keys() if f != 'artwork' and not f.startswith('#')]))
-    return d
-
-def consolidateTag(data, tag):
-    values = Counter()
-    for i in data:
-        track = data[i]
-        if tag in track:
-            x = listToTuple(track[tag])
-
-            values[x] += 1
+    # ALL_TAGS already excludes artwork and the # info fields
+    return {f: noList(tags[f].values) for f in tags.keys() if f in ALL_TAGS_SET}
+
+def consolidateTags(data):
+    """ Count the values of each tag across all the tracks, in a single pass """
+    values = defaultdict(Counter)
+    for track in data.values():
+        for tag, value in track.items():
+            # Only real tags, anything else (such as already promoted data) may not even be hashable
+            if tag in ALL_TAGS_SET:
+                values[tag][listToTuple(value)] += 1
     return values
 
 def tupleToList(x):
@@ -123,20 +152,21 @@ COMMON_TAG = 'common'
 TRACK_TAG = 'tracks'
 
 def promoteTags(tags):
-    consolidated = {}
     grpTags = {}
     grpSize = len(tags)
-    for tag in ALL_TAGS:
-        consolidated = consolidateTag(tags, tag)
+    for tag, consolidated in consolidateTags(tags).items():
         # Check that there's only 1 tag
         if len(consolidated) == 1:
             item = consolidated.popitem()
             # And that it's in every file
             if item[1] == grpSize:
                 grpTags[tag] = tupleToList(item[0])
-                for i in tags:
-                    if tag in tags[i]:
-                        del tags[i][tag]
+
+    # Remove the promoted tags from the tracks in one sweep
+    if grpTags:
+        for track in tags.values():
+            for tag in grpTags:
+                del track[tag]
     return grpTags, tags
 
 def partitionByTag(data, tag):
@@ -220,13 +250,16 @@ def copyTags(frTags, toTags, tags, replace, delete, details=None):
         (added, replaced, deleted, errors) = details
 
     for tag in frTags.keys():
-        if not tag in ALL_TAGS:
+        if not tag in ALL_TAGS_SET:
             cprint(f"Unknown tag {tag} for file {toTags.filename}", "red")
 
     for tag in tags:
         try:
 
             frValue = frTags.get(tag, None)
+            # Nothing to copy or delete, so don't bother fetching the destination value
+            if not frValue and not delete:
+                continue
             if frValue and not isinstance(frValue, list):
                 frValue = [frValue]
 
@@ -244,7 +277,7 @@ def copyTags(frTags, toTags, tags, replace, delete, details=None):
                         # TODO: This should check all artwork, but I'm lazy, assuming only one in my library.
                         if frValue.first.data == toValue.first.data:
                             continue
-                    elif set(frValue) == set(toValue.values):
+                    elif frValue == toValue.values or set(frValue) == set(toValue.values):
                         continue
                     if not replace:
                         continue
@@ -271,60 +304,74 @@ def copyTags(frTags, toTags, tags, replace, delete, details=None):
             nErrors += 1
     return changed, (nAdded, nReplaced, nDeleted, nErrors)
 
-def printSummary(file, details):
-    cprint(f"Setting tags in {file.filename.name}", 'yellow')
+def printSummary(name, details):
+    cprint(f"Setting tags in {name}", 'yellow')
     (added, replaced, deleted, _) = details
     if added:
-        tags = list(map(lambda x: x[0], added))
-        print(f"{colored('Added', 'cyan'):17}: {pprint.pformat(tags, compact=True, width=132)}")
+        tags = [x[0] for x in added]
+        print(f"{colored('Added', 'cyan'):17}: {', '.join(tags)}")
     if replaced:
-        tags = list(map(lambda x: x[0], replaced))
-        print(f"{colored('Replaced', 'cyan'):17}: {pprint.pformat(tags, compact=True, width=132)}")
+        tags = [x[0] for x in replaced]
+        print(f"{colored('Replaced', 'cyan'):17}: {', '.join(tags)}")
     if deleted:
-        tags = list(map(lambda x: x[0], deleted))
-        print(f"{colored('Deleted', 'cyan'):17}: {pprint.pformat(tags, compact=True, width=132)}")
+        tags = [x[0] for x in deleted]
+        print(f"{colored('Deleted', 'cyan'):17}: {', '.join(tags)}")
     #if not (added or deleted or replaced):
     #    cprint("Nothing changed", "cyan")
 
 
 def setTags(newData, currentData, replace, delete):
+    """ Copy the new tags into the loaded files.   Returns the list of files which changed """
     nChanged = 0
     results = []
     fChanged = []
     for file in sorted(currentData, key=lambda x: x.filename):
         details = ([], [], [], [])
+        name = file.filename.name
 
         try:
-            new = newData[file.filename.name]
+            new = newData[name]
             changed, stats = copyTags(new, file, ALL_TAGS, replace, delete, details=details)
             nChanged += changed
-            if changed:
-                fChanged.append(file.filename.name)
             results.append(stats)
             if changed:
-                printSummary(file, details)
+                fChanged.append(file)
+                printSummary(name, details)
         except KeyError:
             print(f"Tags for {file.filename} not found.")
     if results:
         (added, replaced, deleted, errors) = addTuples(*results)
         print(f"Files Changed: {nChanged} Tags Added: {added} Tags Changed: {replaced} Tags Deleted: {deleted} Errors: {errors}")
     if fChanged:
-        print(f"Changed: {pprint.pformat(sorted(fChanged), compact=True)}")
+        print(f"Changed: {pprint.pformat(sorted(f.filename.name for f in fChanged), compact=True)}")
     return fChanged
 
 def saveTags(tags, file, format):
     match format:
         case 'json':
-            json.dump(tags, file, indent=4)
+            if orjson:
+                # Partitioned data can have non-string keys, such as disc numbers, which json converts silently
+                file.write(orjson.dumps(tags, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode())
+            else:
+                json.dump(tags, file, indent=2, ensure_ascii=False)
         case 'yaml':
-            file.write(yaml.dump(tags, allow_unicode=True))
+            yaml.dump(tags, file, Dumper=SafeDumper, allow_unicode=True)
 
 def loadTags(file, format):
     match format:
         case 'json':
+            if orjson:
+                return orjson.loads(file.read())
             return json.load(file)
         case 'yaml':
-            return yaml.load(file, yaml.SafeLoader)
+            return yaml.load(file, SafeLoader)
+
+def saveFile(file, preserve):
+    # Only stat when the times need to be restored, and restore them at full (ns) resolution
+    times = os.stat(file.filename) if preserve else None
+    file.save()
+    if preserve:
+        os.utime(file.filename, ns=(times.st_atime_ns, times.st_mtime_ns))
 
 def confirm(prompt, default='y'):
     while True:
@@ -336,63 +383,103 @@ def confirm(prompt, default='y'):
         elif x in ['n', 'no']:
             return False
 
-def main():
-    args = parseArgs()
-
-    fileData = list(loadFiles(args.files))
-
+def checkLoaded(fileData):
     if not fileData:
         cprint("No audio files found", "red")
         sys.exit(1)
+    return fileData
+
+def editTags(origTags, editor):
+    """ Run the editor on a yaml dump of the tags.  Returns the new tags, and whether they are unchanged, or None if abandoned """
+    # Stream the dump through a large buffer, and close it, so the editor is free to replace the file
+    temp = tempfile.NamedTemporaryFile("wb", buffering=1 << 20, suffix=".yaml", delete=False)
+    try:
+        with temp:
+            yaml.dump(origTags, temp, Dumper=SafeDumper, allow_unicode=True, encoding='utf-8')
+        while True:
+            # Run the editor directly, rather than through a shell.  Our descriptors are non-inheritable anyway, so
+            # close_fds isn't needed; without it subprocess can use posix_spawn, if the editor is given with a path
+            try:
+                subprocess.run([*shlex.split(editor), temp.name], check=False, close_fds=False)
+            except (FileNotFoundError, PermissionError) as e:
+                cprint(f"Error running editor {editor}:", "red")
+                cprint(str(e), "yellow")
+                return None
+            try:
+                # Reopen by name, as many editors replace the file rather than rewriting it
+                with open(temp.name, "rb") as edited:
+                    data = edited.read()
+                newTags = yaml.load(data, SafeLoader)
+                return newTags, newTags == origTags
+            except yaml.YAMLError as y:
+                cprint(f"Error parsing edited file:", "red")
+                cprint(str(y), "yellow")
+                if not confirm("Edit again: [Y/n]: "):
+                    return None
+    finally:
+        os.unlink(temp.name)
+
+def main():
+    args = parseArgs()
 
     if args.load:
+        # The tags to edit come from the load file, so read the audio files while the editor runs.  Find them
+        # first though, so any problems are reported before editing, and the loader has nothing to print.
+        files = checkLoaded(findFiles(args.files, args.workers))
+        loader = ThreadPoolExecutor(max_workers=1)
+        pending = loader.submit(doLoadFiles, files, args.workers)
+        loader.shutdown(wait=False)
+        fileData = None
         origTags = loadTags(args.load, args.format)
     else:
-        origTags = dict(map(lambda x: (x.filename.name, makeDict(x)), fileData))
+        fileData = checkLoaded(loadFiles(args.files, args.workers))
+        origTags = {x.filename.name: makeDict(x) for x in fileData}
 
     # If we're using the "promotion" feature, promote all and disc values
     if args.promote and len(origTags) > 1:
         origTags = doPromotion(origTags, [('albums', 'album'), ('discs', 'discnumber'), ('works', 'work')])
 
-    with tempfile.NamedTemporaryFile("w+") as temp:
-        temp.write(yaml.dump(origTags, allow_unicode=True))
-        temp.flush()
-        loaded = False
-        if args.edit:
-            while loaded is False:
-                os.system(f"{args.editor} {temp.name}")
-                try:
-                    temp.seek(0)
-                    newTags = yaml.load(open(temp.name), yaml.SafeLoader)
-                    loaded = True
-                except yaml.YAMLError as y:
-                    cprint(f"Error parsing edited file:", "red")
-                    cprint(str(y), "yellow")
-                    if not confirm("Edit again: [Y/n]: "):
-                        return
-        else:
-            newTags = origTags
+    if args.edit:
+        edited = editTags(origTags, args.editor)
+        if edited is None:
+            return
+        newTags, unchanged = edited
+    else:
+        # Nothing to edit, so the tags are exactly what was read or loaded
+        newTags, unchanged = origTags, True
 
-        if args.save:
-            saveTags(newTags, args.save, args.format)
+    if args.save:
+        saveTags(newTags, args.save, args.format)
 
-        if args.promote and len(origTags) > 1:
-            newTags = demoteTags(newTags)
+    if fileData is None:
+        try:
+            fileData = pending.result()
+        except Exception as e:
+            # Don't throw away the edits, keep them where they can be loaded again
+            with tempfile.NamedTemporaryFile("w", prefix="tagedit-", suffix=f".{args.format}", delete=False) as keep:
+                saveTags(newTags, keep, args.format)
+            cprint(f"Error loading files: {e}", "red")
+            cprint(f"Tags saved in {keep.name}", "yellow")
+            sys.exit(1)
+
+    # If nothing was edited, the files already have these tags, unless they came from a load file
+    if unchanged and not args.load:
+        cprint("No changes", "cyan")
+        return
 
-        changedFiles = setTags(newTags, fileData, args.replace, args.delete)
+    if args.promote and len(origTags) > 1:
+        newTags = demoteTags(newTags)
 
-        if not args.dryrun:
-            if changedFiles:
-                if not args.confirm or confirm("Write changes [Y/n]: "):
-                    for file in fileData:
-                        if not file.filename.name in changedFiles:
-                            continue
-                        times = file.filename.stat()
-                        file.save()
-                        if args.preserve:
-                            os.utime(file.filename, times=(times.st_atime, times.st_mtime))
-            else:
-                cprint("No changes", "cyan")
+    changedFiles = setTags(newTags, fileData, args.replace, args.delete)
+
+    if not args.dryrun:
+        if changedFiles:
+            if not args.confirm or confirm("Write changes [Y/n]: "):
+                # Saving rewrites each file, so do them in parallel
+                with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                    list(executor.map(lambda file: saveFile(file, args.preserve), changedFiles))
+        else:
+            cprint("No changes", "cyan")
 
 
 def run():
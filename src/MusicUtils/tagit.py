@@ -29,29 +29,39 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 
+import io
 import pathlib
-import shutil
 import os
 import textwrap
 import re
+import stat
 import json
 import csv
 import sys
+import threading
 
-from functools import lru_cache, partial
+from functools import lru_cache, partial, wraps
+from itertools import chain
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser, BooleanOptionalAction, ArgumentTypeError, SUPPRESS, RawDescriptionHelpFormatter, FileType
 from hashlib import md5
 
-import magic
 import music_tag
-from PIL import Image
 from termcolor import cprint, colored
 
 from MusicUtils.Utils import isAudio
 
+# Use orjson for the json catalog when it's installed.  The fallback is set up to write exactly the same output
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Extract the list of valid tags from the music_tag module.
 ALL_TAGS = sorted(music_tag.tags())
 VALID_TAGS = sorted([i for i in map(str.upper, ALL_TAGS) if not i.startswith('#')])
+VALID_TAGS_SET = frozenset(VALID_TAGS)
 
 class TagArgument:
     """
@@ -59,14 +69,9 @@ class TagArgument:
     the input.
     """
     def __init__(self, string):
-        try:
-            tag, value = string.split("=", 1)
-            value=value.strip()
-        except ValueError:
-            tag=string.strip("=")
-            value=None
+        tag, sep, value = string.partition("=")
+        value = value.strip() if sep else None
 
-        #print(f"Creating {tag} {value} from {string}")
         self.tag = checkTag(tag.strip())
         self.value=value
         if self.tag.startswith('#'):
@@ -81,20 +86,13 @@ class TagArgument:
 def makeTagArgument(tag, value):
     return TagArgument(f"{tag}={value}")
 
-def backupFile(path):
+def makeTagValues(tagLists):
     """
-    Backup a file before processing it.
+    Collect the values for each tag from the list of tag arguments.
     """
-    bupPath = pathlib.Path(path.with_suffix(path.suffix + '.bak'))
-    print(f"Backing up {path} to {bupPath}")
-    shutil.copy2(path, bupPath)
-
-
-def makeTagValues(tags):
     ret = {}
-    if tags:
-        for t in tags:
-            ret.setdefault(t.tag, set()).add(t.value)
+    for t in tagLists or ():
+        ret.setdefault(t.tag, set()).add(t.value)
     return ret
 
 def checkTag(tag, additional=None):
@@ -103,7 +101,7 @@ def checkTag(tag, additional=None):
     """
     tup = tag.upper()
 
-    if not (tup in VALID_TAGS or (additional and tup in additional)):
+    if not (tup in VALID_TAGS_SET or (additional and tup in additional)):
         raise ArgumentTypeError(f"{tag} is not a valid tag")
     return tup
 
@@ -119,8 +117,8 @@ def parseArgs():
                             epilog=epilog,
                             formatter_class=RawDescriptionHelpFormatter)
     setGroup = parser.add_argument_group("Tag Setting Options")
-    setGroup.add_argument("--tags", "-t",     default=[], dest='tags', type=TagArgument, action='append', nargs='+', help='List of tags to apply.  Ex: --tags "artist=The Beatles" "album=Abbey Road"')
-    setGroup.add_argument("--delete", "-d",   type=checkTag,  action='append', nargs='+', metavar='TAG', help='List of tags to delete.   Ex: --delete artist artistsort')
+    setGroup.add_argument("--tags", "-t",     default=[], dest='tags', type=TagArgument, action='extend', nargs='+', help='List of tags to apply.  Ex: --tags "artist=The Beatles" "album=Abbey Road"')
+    setGroup.add_argument("--delete", "-d",   type=checkTag,  action='extend', nargs='+', metavar='TAG', help='List of tags to delete.   Ex: --delete artist artistsort')
     setGroup.add_argument("--append", "-a",   type=bool, action=BooleanOptionalAction, default=False, help="Add values to current tag")
     setGroup.add_argument("--clear", '-C',    type=bool, action=BooleanOptionalAction, default=False, help='Remove all tags')
     setGroup.add_argument("--empty", '-e',    type=bool, action=BooleanOptionalAction, default=False, help='Remove empty tags')
@@ -133,13 +131,13 @@ def parseArgs():
     printGroup.add_argument("--details", "-D",  type=bool, action=BooleanOptionalAction, default=False, help="Print tags, including read-only encoding details (starts with #)")
     printGroup.add_argument("--all", "-A",      type=bool, action=BooleanOptionalAction, default=False, help="Print all tags, regardless of whether they contain any data")
     printGroup.add_argument("--lists", "-L",    type=bool, action=BooleanOptionalAction, default=True, help="Print list values separately")
-    printGroup.add_argument("--value", "-V",    type=TagArgument, action='append', nargs='+', metavar='TAG=Value', default=[], help="Print only if the tag matches (value is a regular expression)")
+    printGroup.add_argument("--value", "-V",    type=TagArgument, action='extend', nargs='+', metavar='TAG=Value', default=[], help="Print only if the tag matches (value is a regular expression)")
     printGroup.add_argument('--names', '-N',    type=bool, action=BooleanOptionalAction, default=False, help="Only list file names that match")
 
 
     andOr = printGroup.add_mutually_exclusive_group()
-    andOr.add_argument("--and", dest='andOp', action='store_true',  default='True', help="Only print if all values match ")
-    andOr.add_argument("--or",  dest='andOp', action='store_false', default='True', help="Print if any values match ")
+    andOr.add_argument("--and", dest='andOp', action='store_true',  default=True, help="Only print if all values match ")
+    andOr.add_argument("--or",  dest='andOp', action='store_false', default=True, help="Print if any values match ")
 
     saveGroup = parser.add_argument_group("Tag Saving Options (not in music file)")
     saveGroup.add_argument('--save', '-S',     type=FileType('w'), default=None, help="Save tags to a file")
@@ -152,11 +150,12 @@ def parseArgs():
     parser.add_argument("--dryrun", "-n",   type=bool, action=BooleanOptionalAction, default=False, help="Don't save, dry run")
     parser.add_argument("--stats", "-s",    type=bool, action=BooleanOptionalAction, default=False, help="Print stats")
     parser.add_argument("--quiet", "-q",    type=bool, action=BooleanOptionalAction, default=False, help="Run quietly (except for print and stats)")
+    parser.add_argument("--workers", "-w",  type=int, default=1, help="Number of files to process in parallel")
 
     group = parser.add_argument_group("Tags")
     for arg in VALID_TAGS:
         makeTagValFunc = partial(makeTagArgument, arg)
-        group.add_argument(f"--{arg.upper()}", f"--{arg.lower()}", nargs=1, dest="tags", type=makeTagValFunc, action='append', help=SUPPRESS)   #f"Set the {arg} tag")
+        group.add_argument(f"--{arg.upper()}", f"--{arg.lower()}", nargs=1, dest="tags", type=makeTagValFunc, action='extend', help=SUPPRESS)   #f"Set the {arg} tag")
 
     parser.add_argument(type=pathlib.Path,  nargs='+', dest='files', help='Files to change')
 
@@ -167,34 +166,84 @@ def flatten(l):
     Flatten nested sublists to all be a single list.
     """
     if isinstance(l, list):
-        return [num for sublist in l for num in sublist]
+        return list(chain.from_iterable(l))
     return l
 
-@lru_cache(maxsize=64)
+# For callers which only iterate over the result once
+iflatten = chain.from_iterable
+
+class ByteCache:
+    """
+    A least recently used cache, bounded by the total size of the values it holds, rather than their number.
+    """
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = value
+            self.size += len(value)
+            # Always keep the newest entry, even if it's bigger than the whole budget
+            while self.size > self.maxBytes and len(self.entries) > 1:
+                _, old = self.entries.popitem(last=False)
+                self.size -= len(old)
+
+artCache = ByteCache(128 * 1024 * 1024)
+
 def readfile(name):
     """
     Read a file, and cache the results.   For artwork, so we don't have to read the art files multiple times
     :param name: The filename to read
     :return: The bytes in the file
     """
-    with open(name, "rb") as f:
-        return f.read()
+    # Key the cache on the modification time and size too, so a changed file is never served stale
+    st = os.stat(name)
+    key = (name, st.st_mtime_ns, st.st_size)
+    data = artCache.get(key)
+    if data is None:
+        data = pathlib.Path(name).read_bytes()
+        artCache.put(key, data)
+    return data
 
 @lru_cache(maxsize=64)
 def imageInfo(name):
     """
     Read an image file, and generate it's image info
     """
+    # Only needed for artwork, so don't pay for importing them on every run
+    import magic
+    from PIL import Image
+
+    # The artwork is already in memory, as it's needed to set the tag, so work from that rather than reopening
+    # the file.  libmagic only needs the header, and PIL only decodes the header to get the size.
     data = readfile(name)
-    mime = magic.from_buffer(data, mime=True)
-    image = Image.open(name)
+    mime = magic.from_buffer(data[:4096], mime=True)
+    image = Image.open(io.BytesIO(data))
     size = image.size
     hash = md5(data).hexdigest()
     info = f"{name} - {mime} {size[0]}x{size[1]} {hash}"
     return info
 
+def loadTags(file, st):
+    """
+    Load the tags for a file, using the stat from checkFile to key the cache, so a changed file is reread
+    """
+    return _loadTags(file, st.st_mtime_ns, st.st_size)
+
 @lru_cache(maxsize=64)
-def loadTags(file):
+def _loadTags(file, mtime, size):
     return music_tag.load_file(file)
 
 @lru_cache(maxsize=64)
@@ -202,23 +251,65 @@ def checkFile(file):
     """
     Check to determine if a file exists, and is an audio file.
     :param file:
-    :return: True if it exists and is audio, false otherwise
+    :return: The file's stat result if it exists and is audio, None otherwise
     """
+    # A single stat answers both the type checks, and provides the times to preserve
     try:
-        if file.is_dir():
-            print(f"{colored('Error: ', 'red')} {file} is a directory")
-            return False
-        if not (file.is_file() and isAudio(file)):
-            print(f"{colored('Error: ', 'red')} {file} isn't an audio file")
-            return False
+        st = os.stat(file)
+        if stat.S_ISDIR(st.st_mode):
+            say(f"{colored('Error: ', 'red')} {file} is a directory")
+            return None
+        if not (stat.S_ISREG(st.st_mode) and isAudio(file)):
+            say(f"{colored('Error: ', 'red')} {file} isn't an audio file")
+            return None
     except FileNotFoundError:
-        print(f"{colored('Error: ', 'red')} {file} not found")
-        return False
-    return True
-
+        say(f"{colored('Error: ', 'red')} {file} not found")
+        return None
+    except OSError as e:
+        # Unreadable, most likely, when isAudio has to look inside it
+        say(f"{colored('Error: ', 'red')} {file}: {e.strerror}")
+        return None
+    return st
+
+
+# Messages for the file each thread is working on.  They're printed together once the file is done, so output
+# from files processed in parallel doesn't interleave, and each file's messages go out in a single write.
+output = threading.local()
+outputLock = threading.Lock()
+
+def writeOut(text):
+    """ Write text and a newline as a single write, so other threads can't slip anything in between """
+    with outputLock:
+        sys.stdout.write(text + '\n')
+
+def say(msg):
+    """ Print a message, or add it to the current file's messages """
+    lines = getattr(output, 'lines', None)
+    if lines is None:
+        writeOut(str(msg))
+    else:
+        lines.append(str(msg))
 
-stats = { 'processed': 0, 'updated'  : 0, 'added'    : 0, 'changed'  : 0, 'deleted'  : 0, 'split': 0 }
+beQuiet = False
+def qprint(*args):
+    """ Print as long as we're not expected to be quiet """
+    if not beQuiet:
+        say(' '.join(map(str, args)))
 
+def buffered(func):
+    """ Collect the messages func prints for a file, and print them all when it finishes """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        output.lines = []
+        try:
+            return func(*args, **kwargs)
+        finally:
+            lines, output.lines = output.lines, None
+            if lines:
+                writeOut('\n'.join(lines))
+    return wrapper
+
+@buffered
 def processFile(file, tags, splits, delete, preserve, append, empty, splitchars, dryrun):
     """
     Process a file, changing the tags appropriately
@@ -232,67 +323,87 @@ def processFile(file, tags, splits, delete, preserve, append, empty, splitchars,
        empty: Delete empty tags
        splitchars: String, containing the characters to split on
        dryrun: Boolean, if true, don't write output, only process and test.
+
+    Returns the file's tags (None if it couldn't be processed), and a Counter of the changes made.
     """
-    if not checkFile(file):
-        return
+    # Counted per file and totalled by the caller, so the worker threads share nothing
+    counts = Counter()
+    times = checkFile(file)
+    if not times:
+        return None, counts
 
     qprint(colored(f"Processing file {file}", "green"))
-    data = loadTags(file)
+    data = loadTags(file, times)
     updated = False
 
-    stats['processed'] += 1
-    times = file.stat()
-    for tag in tags:
+    counts['processed'] += 1
+    # Tag names all come through checkTag, so they're already upper case
+    for tag, given in tags.items():
         try:
-            if tag.lower() == 'artwork':
-                values = map(readfile, tags[tag])
+            # Build the set of new values once, the given values are already a set
+            isArt = tag == 'ARTWORK'
+            if isArt:
+                values = set(map(readfile, given))
             else:
-                values = tags[tag]
+                values = given
 
             try:
-                curVals = set(data[tag].values)
+                curList = data[tag].values
             except ValueError as e:
-                cprint(f'{e}: zeroing', 'red')
-                curVals = set()
+                say(colored(f'{e}: zeroing', 'red'))
+                curList = []
+            if isArt:
+                # music_tag hands back Artwork objects, which never equal the raw bytes read from the files,
+                # so compare the image data itself.  Keep the objects for printing.
+                curArt = curList
+                curList = [a.data for a in curArt]
+
+            # On a rerun the values are usually already there, in the same order, so a plain list compare
+            # settles it without building any sets.  Equal lists are equal sets, appended or not.
+            if curList == list(values):
+                continue
+            curVals = set(curList)
 
             # If current values, we've changed it, else adding a tag.
             action = 'changed' if curVals else 'added'
             # Generate the new set of values
             if append:
-                newVals = list(set(values).union(curVals))
-            else:
-                newVals = list(values)
+                values = values | curVals
 
-            if set(newVals) == curVals:
+            if values == curVals:
                 # if nothing has changed, skip it.
                 continue
+            newVals = list(values)
 
-            if tag.lower() == 'artwork':
+            # Don't bother formatting the message (or inspecting the artwork) if it won't be printed
+            if beQuiet:
+                pass
+            elif isArt:
                 # If we're doing artwork, generate a readable version and print it, other than the raw value
                 if append:
-                    vals = list(set(map(imageInfo, tags[tag])).union(map(str, data[tag].values)))
+                    vals = list(set(map(imageInfo, given)).union(map(str, curArt)))
                 else:
-                    vals = list(map(imageInfo, tags[tag]))
-                qprint(f"    Setting tag {tag.upper()} to {vals}")
+                    vals = list(map(imageInfo, given))
+                qprint(f"    Setting tag {tag} to {vals}")
             else:
                 # Otherwise, just print the new values
-                qprint(f"    Setting tag {tag.upper()} to {newVals}")
+                qprint(f"    Setting tag {tag} to {newVals}")
 
             # And save it.
-            data[tag.upper()] = newVals
-            stats[action] += 1
+            data[tag] = newVals
+            counts[action] += 1
             updated = True
         except KeyError as k:
-            cprint(f'Invalid tag name {k}', 'red')
+            say(colored(f'Invalid tag name {k}', 'red'))
         except FileNotFoundError as e:
-            cprint(f'Could not read artwork file {e.filename}')
+            say(f'Could not read artwork file {e.filename}')
         except ValueError as v:
-            cprint(v, 'red')
+            say(colored(str(v), 'red'))
 
     splitpat = f"[{splitchars}]"
     if splits:
         for tag in splits:
-            if tag.lower() == 'artwork':
+            if tag == 'ARTWORK':
                 continue
             try:
                 curVals = set(map(str, data[tag].values))
@@ -303,11 +414,11 @@ def processFile(file, tags, splits, delete, preserve, append, empty, splitchars,
                 if newVals != curVals:
                     newVals = list(newVals)
                     qprint(f"    Splitting tag {tag} to {newVals}")
-                    data[tag.upper()] = list(newVals)
+                    data[tag] = newVals
                     updated = True
-                    stats['split'] += 1
+                    counts['split'] += 1
             except ValueError as v:
-                cprint(v, 'red')
+                say(colored(str(v), 'red'))
 
     if delete:
         for tag in delete:
@@ -315,38 +426,39 @@ def processFile(file, tags, splits, delete, preserve, append, empty, splitchars,
                 qprint(f"    Removing tag {tag}")
                 data.remove_tag(tag)
                 updated = True
-                stats['deleted'] += 1
+                counts['deleted'] += 1
 
     if empty:
-        for tag, value in data.items():
-            if not value:
-                qprint(f"    Removing empty tag {tag}")
-                data.remove_tag(tag)
-                updated = True
-                stats['deleted'] += 1
+        # Collect the empty tags first, rather than removing them while iterating
+        for tag in [tag for tag, value in data.items() if not value]:
+            qprint(f"    Removing empty tag {tag}")
+            data.remove_tag(tag)
+            updated = True
+            counts['deleted'] += 1
 
     if updated:
-        stats['updated'] += 1
+        counts['updated'] += 1
     if not dryrun and updated:
         data.save()
         if preserve:
-            os.utime(file, times=(times.st_atime, times.st_mtime))
+            os.utime(file, ns=(times.st_atime_ns, times.st_mtime_ns))
 
-    return data
+    return data, counts
 
+@buffered
 def removeTags(file, preserve, dryrun):
     """ Remove all tags from the file """
-    if not checkFile(file):
+    times = checkFile(file)
+    if not times:
         return
-    times = file.stat()
-    data = loadTags(file)
+    data = loadTags(file, times)
     qprint(f"Removing tags from {file}")
     data.remove_all()
 
     if not dryrun:
         data.save()
         if preserve:
-            os.utime(file, times=(times.st_atime, times.st_mtime))
+            os.utime(file, ns=(times.st_atime_ns, times.st_mtime_ns))
 
 orderedTags = {
     'title': '00',
@@ -360,44 +472,63 @@ orderedTags = {
 def tagKey(key):
     return orderedTags.get(key.lower(), '99') + key
 
+tagOrders = {}
 
-def printTags(file, tags, empty, details, names, printList, save):
+def tagOrder(data):
+    """
+    The tags a file supports, upper cased, in the order to print them.
+    The tags depend only on the type of file, so only sort them once per type.
+    """
+    kind = type(data)
+    order = tagOrders.get(kind)
+    if order is None:
+        order = tagOrders[kind] = [tag.upper() for tag in sorted(data.tags(), key=tagKey)]
+    return order
+
+
+def printTags(file, tags, empty, details, names, printList, save, data=None):
     """
     Print tags from a file.
 
     Parameters:
     file (Path):        file to load tags from and to print.
-    tags (list[str]):   list of tags to print
+    tags (frozenset):   tags to print, upper case.  Empty to print all
     empty   (bool):     print all the tags, even those with empty/no value
     details (bool):     include those that start with a # sign
     names   (bool):     Only printh the name of the file
     printList(bool):    Print all elements of a list together
     save    (bool):     Save the tags for later processing
+    data (AudioFile):   The file's tags, if they've already been loaded
     """
-    if not checkFile(file):
-        return
+    if data is None:
+        st = checkFile(file)
+        if not st:
+            return
 
     if names:
-        print(file)
+        say(file)
         return
 
-    cprint(f"File: {file}", "green")
-    data =  loadTags(file)
+    say(colored(f"File: {file}", "green"))
+    if data is None:
+        data = loadTags(file, st)
 
-    for tag in map(str.upper, sorted(data.tags(), key=tagKey)):
+    for tag in tagOrder(data):
         try:
             if tags and not tag in tags:
                 continue
             if tag.startswith('#') and not details:
                 continue
-            if data[tag] or empty:
+            # Each lookup goes through music_tag's tag mapping, so only do it once
+            current = data[tag]
+            if current or empty:
                 if printList:
-                    print(f"{tag:27}: {data[tag]}")
+                    say(f"{tag:27}: {current}")
                 else:
-                    for i in data[tag].values:
-                        print(f"{tag:27}: {i}")
+                    for i in current.values:
+                        say(f"{tag:27}: {i}")
         except Exception as e:
-            cprint(f"Caught exception processing tag {tag}: {e}", 'red')
+            say(colored(f"Caught exception processing tag {tag}: {e}", 'red'))
     return data
 
 savedData={}
@@ -426,7 +557,7 @@ def saveTags(file, tagData, fullpath, relative):
         if len(d) == 0:
             continue
 
-        if len(d) == 1 and tag.lower() != 'artwork':
+        if len(d) == 1 and tag != 'artwork':
             # Ignore artwork, it will get converted to a string below.   We mostly want to keep Int's valid here.
             d = d[0]
         else:
@@ -435,13 +566,11 @@ def saveTags(file, tagData, fullpath, relative):
         data[tag] = d
     savedData[str(file)] = data
 
-beQuiet = False
-def qprint(*args):
-    """ Print as long as we're not expected to be quiet """
-    if not beQuiet:
-        print(*args)
 
 def makeRegEx(values):
+    """
+    Compile the --value expressions into a list of (tag, regex) checks.
+    """
     errors = False
     checks = []
     for x in values:
@@ -467,14 +596,59 @@ def checkTagRegEx(data, tag, regex):
     return False
 
 def checkTagsRegEx(file, checks, andOp=True):
-    if not checkFile(file):
-        return False
-    data = loadTags(file)
-    if andOp:
-        return all(map(lambda x: checkTagRegEx(data, x[0], x[1]), checks))
-    else:
-        return any(map(lambda x: checkTagRegEx(data, x[0], x[1]), checks))
-
+    """
+    Check the file's tags against the value expressions.
+    Returns whether it matched, and the loaded tags, so they can be printed without loading them again.
+    """
+    st = checkFile(file)
+    if not st:
+        return False, None
+    data = loadTags(file, st)
+    # Stop at the first check that decides it, a failure for and, a match for or
+    for tag, regex in checks:
+        matched = checkTagRegEx(data, tag, regex)
+        if andOp and not matched:
+            return False, data
+        if matched and not andOp:
+            return True, data
+    return bool(andOp), data
+
+
+def expandFiles(files):
+    """
+    Replace any directories in the list with their contents, and drop any files named more than once.
+    """
+    paths = []
+    for f in files:
+        if not f.is_dir():
+            paths.append(f)
+            continue
+        with os.scandir(f) as entries:
+            paths.extend(pathlib.Path(e.path) for e in sorted(entries, key=lambda e: e.name))
+
+    # The same file can be named more than once, by repeated or overlapping arguments, or through symlinks.
+    # Only process each one once.
+    seen = set()
+    unique = []
+    for path in paths:
+        real = path.resolve()
+        if real not in seen:
+            seen.add(real)
+            unique.append(path)
+    return unique
+
+def mapFiles(func, files, workers):
+    """
+    Run func over each of the files in a pool of threads, yielding (file, result) in the original order.
+    The caller collects the saved data and stats from the results, so nothing is shared between the threads.
+    """
+    # No point starting more threads than there are files
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(files))))
+    try:
+        yield from zip(files, executor.map(func, files))
+    finally:
+        # If interrupted, let the files in progress finish, but don't start any more
+        executor.shutdown(wait=True, cancel_futures=True)
 
 def main():
     global beQuiet
@@ -482,45 +656,52 @@ def main():
     if args.quiet:
         beQuiet = True
 
-    # If there's only one file, and it's a directory, list it
-    if len(args.files) == 1 and args.files[0].is_dir():
-        files = sorted(args.files[0].iterdir())
-    else:
-        files = args.files
+    files = expandFiles(args.files)
 
     if args.print or not (args.tags or args.delete or args.clear or args.empty or args.split):
         # Printing files.   Compute the tags to print, then print 'em
-        printtags = []
+        printtags = frozenset()
         if args.print:
-            printtags = list(map(str.upper, flatten(args.print)))
+            printtags = frozenset(map(str.upper, iflatten(args.print)))
         if args.value:
             try:
-                checks = makeRegEx(flatten(args.value))
+                checks = makeRegEx(args.value)
             except ValueError as e:
                 cprint(e, "yellow")
                 sys.exit(1)
         else:
             checks = None
-        for file in files:
-            if not checks or checkTagsRegEx(file, checks, args.andOp):
-                data = printTags(file, printtags, args.all, args.details, args.names, args.lists, args.save)
-                if args.save and data:
-                    saveTags(file, data, args.fullpath, args.relative)
+        # Buffer the whole thing, so any errors from the checks come out with the rest of the file's output
+        @buffered
+        def printFile(file):
+            data = None
+            if checks:
+                matched, data = checkTagsRegEx(file, checks, args.andOp)
+                if not matched:
+                    return None
+            return printTags(file, printtags, args.all, args.details, args.names, args.lists, args.save, data)
+
+        for file, data in mapFiles(printFile, files, args.workers):
+            if args.save and data:
+                saveTags(file, data, args.fullpath, args.relative)
     elif args.clear:
         # clear all the tags.
-        for f in files:
-            removeTags(f, args.preserve, args.dryrun)
+        list(mapFiles(partial(removeTags, preserve=args.preserve, dryrun=args.dryrun), files, args.workers))
     else:
         # Else we're setting tags.
-        tags   = makeTagValues(flatten(args.tags))
+        tags   = makeTagValues(args.tags)
         splits = flatten(args.split)
         if args.split and (not splits or 'ALL' in splits):
             splits=VALID_TAGS
 
-        delete = flatten(args.delete)
+        # Drop repeated tag names, so each tag is only probed and removed once per file
+        delete = list(dict.fromkeys(args.delete)) if args.delete else None
 
-        for file in files:
-            data = processFile(file, tags, splits, delete, args.preserve, args.append, args.empty, args.splitchars, args.dryrun)
+        process = partial(processFile, tags=tags, splits=splits, delete=delete, preserve=args.preserve, append=args.append,
+                          empty=args.empty, splitchars=args.splitchars, dryrun=args.dryrun)
+        stats = Counter()
+        for file, (data, counts) in mapFiles(process, files, args.workers):
+            stats.update(counts)
             if args.save and data:
                 saveTags(file, data, args.fullpath, args.relative)
 
@@ -530,9 +711,18 @@ def main():
     if args.save:
         match args.format:
             case 'json':
-                json.dump(savedData, args.save, indent=4)
+                if orjson:
+                    args.save.write(orjson.dumps(savedData, option=orjson.OPT_INDENT_2).decode())
+                else:
+                    json.dump(savedData, args.save, indent=2, ensure_ascii=False)
             case 'yaml':
-                args.save.write(yaml.dump(savedData, allow_unicode=True))
+                # Only needed when saving, so import it here.  Use the libyaml based dumper when available
+                import yaml
+                try:
+                    from yaml import CSafeDumper as SafeDumper
+                except ImportError:
+                    from yaml import SafeDumper
+                yaml.dump(savedData, args.save, Dumper=SafeDumper, allow_unicode=True)
             case 'csv':
                 writer = csv.DictWriter(args.save, fieldnames=['name'] + ALL_TAGS)
                 writer.writeheader()